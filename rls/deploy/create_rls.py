@@ -1,10 +1,15 @@
 #!/usr/bin/env python3
 import boto3
 import csv
+import json
+import uuid
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from os import environ as os_environ
 from sys import exit
 from botocore.client import Config
 import logging
+import time
 
 CID_USER_OWNER_TAG = os_environ['CID_USER_OWNER_TAG'].strip() if 'CID_USER_OWNER_TAG' in os_environ else 'cid_users'
 CID_GROUP_OWNER_TAG = os_environ['CID_GROUP_OWNER_TAG'].strip() if 'CID_GROUP_OWNER_TAG' in os_environ else 'cid_groups'
@@ -20,13 +25,20 @@ MANAGEMENTROLENAME = os_environ['MANAGEMENTROLENAME'].strip() if 'MANAGEMENTROLE
 CID_FULL_ACCESS_USERS = os_environ['CID_FULL_ACCESS_USERS'].strip() if 'CID_FULL_ACCESS_USERS' in os_environ else None
 CID_FULL_ACCESS_GROUP = os_environ['CID_FULL_ACCESS_GROUP'].strip() if 'CID_FULL_ACCESS_GROUP' in os_environ else None
 RLS_LOGGING_LEVEL = os_environ['RLS_LOGGING_LEVEL'].strip() if 'RLS_LOGGING_LEVEL' in os_environ else 'INFO'
+RLS_INCREMENTAL = (os_environ['RLS_INCREMENTAL'].strip().lower() if 'RLS_INCREMENTAL' in os_environ else 'yes') in ('yes', 'true', '1')
+RLS_STATE_KEY = 'cid_rls/cid_rls_state.json'
+QS_RLS_DATASET_IDS = [dataset_id.strip() for dataset_id in os_environ.get('QS_RLS_DATASET_IDS', '').split(',') if dataset_id.strip()]
+QS_NAMESPACES = [namespace.strip() for namespace in os_environ['QS_NAMESPACES'].split(',')] if 'QS_NAMESPACES' in os_environ else ['default']
+MAX_PAYER_WORKERS = int(os_environ['MAX_PAYER_WORKERS'].strip()) if 'MAX_PAYER_WORKERS' in os_environ else 4
+MAX_WORKERS = int(os_environ['MAX_WORKERS'].strip()) if 'MAX_WORKERS' in os_environ else 10
 
 
 def assume_management_role(payer_id, region):
     role_name = os_environ["MANAGEMENTROLENAME"]
-    partition = boto3.session.Session().get_partition_for_region(region_name=region)
+    session = boto3.session.Session()  # one session per call, default session is not thread safe
+    partition = session.get_partition_for_region(region_name=region)
     management_role_arn = f"arn:{partition}:iam::{payer_id}:role/{role_name}"
-    sts_connection = boto3.client('sts')
+    sts_connection = session.client('sts')
     acct_b = sts_connection.assume_role(
         RoleArn=management_role_arn,
         RoleSessionName="cross_acct_lambda"
@@ -34,33 +46,34 @@ def assume_management_role(payer_id, region):
     ACCESS_KEY = acct_b['Credentials']['AccessKeyId']
     SECRET_KEY = acct_b['Credentials']['SecretAccessKey']
     SESSION_TOKEN = acct_b['Credentials']['SessionToken']
-    client = boto3.client(
+    client = session.client(
         "organizations", region_name=region,
-        aws_access_key_id=ACCESS_KEY, aws_secret_access_key=SECRET_KEY, aws_session_token=SESSION_TOKEN
+        aws_access_key_id=ACCESS_KEY, aws_secret_access_key=SECRET_KEY, aws_session_token=SESSION_TOKEN,
+        config=Config(max_pool_connections=MAX_WORKERS, retries={'max_attempts': 10, 'mode': 'adaptive'})  # Organizations throttles at a low TPS
     )
     return client
 
 
+def new_rls_entry(full_access=False):
+    """ RLS entry of a user or a group. Sets keep ids unique, they are sorted only when written to csv """
+    return {'account_id': set(), 'payer_id': set(), 'full_access': full_access}
+
+
 def update_tag_data(account, users, groups, ou_tag_data, separator=":"):
     users = users.split(separator) if users is not None else []
     groups = groups.split(separator) if groups is not None else []
 
     for group in groups:
         group = group.strip()
-
-        if group in ou_tag_data['Groups']:
-            if account not in ou_tag_data['Groups'][group]:
-                ou_tag_data['Groups'][group]['account_id'].append(account)
-        else:
-            ou_tag_data['Groups'].update({group: {'account_id': [account]}})
+        if group not in ou_tag_data['Groups']:
+            ou_tag_data['Groups'][group] = new_rls_entry()
+        ou_tag_data['Groups'][group]['account_id'].add(account)
 
     for user in users:
         user = user.strip()
-        if user in ou_tag_data['Users']:
-            if account not in ou_tag_data['Users'][user]:
-                ou_tag_data['Users'][user]['account_id'].append(account)
-        else:
-            ou_tag_data['Users'].update({user: {'account_id': [account]}})
+        if user not in ou_tag_data['Users']:
+            ou_tag_data['Users'][user] = new_rls_entry()
+        ou_tag_data['Users'][user]['account_id'].add(account)
     return ou_tag_data
 
 
@@ -105,18 +118,222 @@ def get_ou_accounts(org_client, ou, accounts_list=None, process_ou_children=True
     return accounts_list
 
 
+def get_resource_tags(org_client, resource_id):
+    tags = []
+    for page in org_client.get_paginator('list_tags_for_resource').paginate(ResourceId=resource_id):
+        tags.extend(page['Tags'])
+    return tags
+
+
+def get_tags(org_client, resource_ids, tags_cache):
+    """ Resolve tags of accounts and OUs. Only ids missing from tags_cache are fetched, concurrently,
+        throttling is retried by the client config. Returns tags_cache {resource_id: [tags]} """
+    missing_ids = [resource_id for resource_id in dict.fromkeys(resource_ids) if resource_id not in tags_cache]
+    rls_logger.debug(f"Fetching tags for {len(missing_ids)} resources, {len(tags_cache)} already cached")
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        for resource_id, tags in zip(missing_ids, executor.map(lambda resource_id: get_resource_tags(org_client, resource_id), missing_ids)):
+            tags_cache[resource_id] = tags
+    return tags_cache
+
+
+def get_ou_node(org_client, ou):
+    """ Fetch direct children OUs and direct ACTIVE accounts of one OU """
+    return {
+        'children': get_children_ou(ou, org_client),
+        'accounts': [account['Id'] for account in get_ou_accounts(org_client, ou, process_ou_children=False)],
+    }
+
+
+def get_org_snapshot(org_client, root_ou, tags_cache):
+    """ Walk the org tree once and return {ou_id: node}. Each OU is fetched exactly once, nodes are fetched in a bounded thread pool
+        and children are submitted as soon as their parent is known. Tags of all OUs and accounts are resolved in tags_cache. """
+    org_snapshot = {}
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        futures = {executor.submit(get_ou_node, org_client, root_ou): root_ou}
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                ou = futures.pop(future)
+                org_snapshot[ou] = future.result()
+                for child_ou in org_snapshot[ou]['children']:
+                    futures[executor.submit(get_ou_node, org_client, child_ou)] = child_ou
+    account_ids = [account_id for node in org_snapshot.values() for account_id in node['accounts']]
+    get_tags(org_client, list(org_snapshot) + account_ids, tags_cache)
+    for ou, node in org_snapshot.items():
+        node['tags'] = tags_cache[ou]
+    rls_logger.debug(f"Org snapshot for root ou: {root_ou} has {len(org_snapshot)} OUs")
+    return org_snapshot
+
+
 def dict_list_to_csv(dict):
     for key in dict:
         dict[key] = ','.join(dict[key])
     return dict
 
 
-def upload_to_s3(file, s3_file):
+def get_s3_client():
+    return boto3.client('s3', os_environ["QS_REGION"], config=Config(s3={'addressing_style': 'path'}))
+
+
+def upload_to_s3(file, s3_file, metadata=None):
     try:
-        s3 = boto3.client('s3', os_environ["QS_REGION"], config=Config(s3={'addressing_style': 'path'}))
-        s3.upload_file(file, BUCKET_NAME, f"cid_rls/{s3_file}")
+        s3 = get_s3_client()
+        s3.upload_file(file, BUCKET_NAME, f"cid_rls/{s3_file}", ExtraArgs={'Metadata': metadata} if metadata else None)
+        return True
     except Exception as e:
         rls_logger.debug(e)
+        return False
+
+
+def get_fingerprint(data):
+    return hashlib.sha256(json.dumps(data, sort_keys=True, default=sorted).encode('utf-8')).hexdigest()
+
+
+def get_file_hash(file):
+    sha256 = hashlib.sha256()
+    with open(file, 'rb') as rls_file:
+        for block in iter(lambda: rls_file.read(1024 * 1024), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def get_snapshot_fingerprint(org_snapshot, tags_cache):
+    """ Fingerprint of the org tree and of the RLS relevant tags of all its OUs and accounts """
+    def rls_tags(resource_id):
+        return sorted((tag['Key'], tag['Value']) for tag in tags_cache[resource_id] if tag['Key'] in (CID_USER_OWNER_TAG, CID_GROUP_OWNER_TAG))
+    return get_fingerprint({
+        ou: {
+            'children': sorted(node['children']),
+            'accounts': {account_id: rls_tags(account_id) for account_id in node['accounts']},
+            'tags': rls_tags(ou),
+        } for ou, node in org_snapshot.items()
+    })
+
+
+def rls_data_to_json(rls_data):
+    return {
+        kind: {name: {'account_id': sorted(entry['account_id']), 'payer_id': sorted(entry['payer_id'])} for name, entry in rls_data[kind].items()}
+        for kind in ('Users', 'Groups')
+    }
+
+
+def rls_data_from_json(rls_json):
+    rls_data = {'Users': {}, 'Groups': {}}
+    for kind in rls_data:
+        for name, entry in rls_json.get(kind, {}).items():
+            rls_data[kind][name] = new_rls_entry()
+            rls_data[kind][name]['account_id'].update(entry['account_id'])
+            rls_data[kind][name]['payer_id'].update(entry['payer_id'])
+    return rls_data
+
+
+def merge_rls_data(ou_tag_data, payer_tag_data):
+    for kind in ('Users', 'Groups'):
+        for name, entry in payer_tag_data[kind].items():
+            if name not in ou_tag_data[kind]:
+                ou_tag_data[kind][name] = new_rls_entry()
+            ou_tag_data[kind][name]['account_id'].update(entry['account_id'])
+            ou_tag_data[kind][name]['payer_id'].update(entry['payer_id'])
+    return ou_tag_data
+
+
+def read_rls_state():
+    """ State of the last published run: run fingerprint and per payer org fingerprint with its RLS data """
+    try:
+        return json.loads(get_s3_client().get_object(Bucket=BUCKET_NAME, Key=RLS_STATE_KEY)['Body'].read())
+    except Exception as e:
+        rls_logger.info(f"No previous RLS state found, running full refresh: {e}")
+        return {}
+
+
+def write_rls_state(rls_state):
+    try:
+        get_s3_client().put_object(Bucket=BUCKET_NAME, Key=RLS_STATE_KEY, Body=json.dumps(rls_state).encode('utf-8'))
+    except Exception as e:
+        rls_logger.warning(f"Cannot save RLS state: {e}")
+
+
+def get_published_hash(s3_file):
+    try:
+        return get_s3_client().head_object(Bucket=BUCKET_NAME, Key=f"cid_rls/{s3_file}")['Metadata'].get('content-sha256')
+    except Exception as e:
+        rls_logger.debug(e)
+        return None
+
+
+def start_ingestion():
+    """ Refresh QuickSight RLS datasets configured in QS_RLS_DATASET_IDS """
+    qs_client = boto3.client('quicksight', region_name=QS_REGION)
+    for dataset_id in QS_RLS_DATASET_IDS:
+        try:
+            qs_client.create_ingestion(AwsAccountId=QS_ACCOUNT_ID, DataSetId=dataset_id, IngestionId=str(uuid.uuid4()))
+            rls_logger.info(f"Started ingestion of RLS dataset: {dataset_id}")
+        except Exception as e:
+            rls_logger.warning(f"Cannot start ingestion of RLS dataset {dataset_id}: {e}")
+
+
+def parse_payer(aws_payer_acount):
+    """ returns (payer_id, identity_region) from MANAGEMENT_ACCOUNT_IDS entry with format ACC_ID[:REGION] """
+    if ':' in aws_payer_acount:
+        return aws_payer_acount.split(':')[0], aws_payer_acount.split(':')[1]
+    return aws_payer_acount, QS_REGION
+
+
+def process_payer(aws_payer_acount, tags_cache, rls_state):
+    """ Walk the org of one payer and return (payer_id, org fingerprint, RLS data of this payer) """
+    aws_payer_account_id, identity_region = parse_payer(aws_payer_acount)
+    aws_org_client = assume_management_role(aws_payer_account_id, identity_region)
+    root_ou = aws_org_client.list_roots()['Roots'][0]['Id']
+    rls_logger.debug(f"Start processing for AWS payer account: {aws_payer_account_id}, root_ou: {root_ou}, with QS Region: {identity_region}")
+    org_snapshot = get_org_snapshot(aws_org_client, root_ou, tags_cache)
+    fingerprint = get_snapshot_fingerprint(org_snapshot, tags_cache)
+    payer_state = rls_state.get('payers', {}).get(aws_payer_account_id, {})
+    if RLS_INCREMENTAL and payer_state.get('fingerprint') == fingerprint:
+        rls_logger.info(f"Org of payer {aws_payer_account_id} is unchanged, reusing RLS data of the previous run")
+        return aws_payer_account_id, fingerprint, rls_data_from_json(payer_state['rls_data'])
+    payer_tag_data = {'Users': {}, 'Groups': {}}
+    payer_tag_data = process_ou(tags_cache, org_snapshot, root_ou, payer_tag_data, root_ou)
+    payer_tag_data = process_root_ou(org_snapshot, aws_payer_account_id, root_ou, payer_tag_data)  # -> will recreate root process
+    return aws_payer_account_id, fingerprint, payer_tag_data
+
+
+def process_payers(aws_payer_acounts, tags_cache, rls_state):
+    """ Process payers concurrently. A failing payer does not abort others, it falls back to the RLS data of the previous run.
+        If a failing payer has no previous data, raises to keep the current RLS file: dropping the payer would revoke access of its users.
+        Returns list of (payer RLS data, payer state) """
+    def timed_process_payer(aws_payer_acount):
+        start = time.time()
+        try:
+            return process_payer(aws_payer_acount, tags_cache, rls_state), None, time.time() - start
+        except Exception as exc:
+            return None, exc, time.time() - start
+
+    results = []
+    summary = []
+    missing = []
+    with ThreadPoolExecutor(max_workers=MAX_PAYER_WORKERS) as executor:
+        for aws_payer_acount, (result, exc, duration) in zip(aws_payer_acounts, executor.map(timed_process_payer, aws_payer_acounts)):
+            aws_payer_account_id = parse_payer(aws_payer_acount)[0]
+            if exc is None:
+                _, fingerprint, payer_tag_data = result
+                results.append((payer_tag_data, {'payer_id': aws_payer_account_id, 'fingerprint': fingerprint, 'rls_data': rls_data_to_json(payer_tag_data)}))
+                summary.append(f"{aws_payer_account_id}: OK in {duration:.1f}s")
+                continue
+            rls_logger.error(f"Failed processing payer {aws_payer_account_id}: {type(exc).__name__}: {exc}")
+            previous_state = rls_state.get('payers', {}).get(aws_payer_account_id)
+            if previous_state:
+                results.append((rls_data_from_json(previous_state['rls_data']), previous_state))
+                summary.append(f"{aws_payer_account_id}: FAILED in {duration:.1f}s, using data of the previous run")
+            else:
+                summary.append(f"{aws_payer_account_id}: FAILED in {duration:.1f}s, no data of a previous run")
+                missing.append(aws_payer_account_id)
+    rls_logger.info("Payers processing summary:\n" + "\n".join(summary))
+    if not results:
+        raise Exception("All payers failed, RLS file is not updated")
+    if missing:
+        rls_logger.error(f"Payers {', '.join(missing)} failed and have no data of a previous run, RLS file is not updated")
+        raise Exception(f"Payers {', '.join(missing)} failed without previous RLS data, RLS file is not updated")
+    return results
 
 
 def main(separator=":"):
@@ -124,69 +341,71 @@ def main(separator=":"):
     ou_tag_data = {'Users': {}, 'Groups': {}}
     qs_client = boto3.client('quicksight', region_name=QS_REGION)
     rls_logger.debug("Fetching list of QS users")
-    qs_users = get_qs_users(QS_ACCOUNT_ID, qs_client)
-    qs_users = {qs_user['UserName']: qs_user['Email'] for qs_user in qs_users}
+    qs_email_user_map = get_qs_user_index(QS_ACCOUNT_ID, qs_client, QS_NAMESPACES)
+    tags_cache = {}
+    rls_state = read_rls_state() # also the fallback of failing payers when not incremental
+    new_rls_state = {'payers': {}}
     cid_full_access_users = CID_FULL_ACCESS_USERS.split(',') if CID_FULL_ACCESS_USERS is not None else []
     rls_logger.debug(f"Global full access users: {cid_full_access_users}")
     rls_logger.debug(f"Global full access group: {CID_FULL_ACCESS_GROUP}")
-    rls_logger.debug(f"Active QuickSight qs_users: {qs_users}")
-    for aws_payer_acount in [r.strip() for r in MANAGEMENT_ACCOUNT_IDS.split(',')]:
-        if ':' in aws_payer_acount:
-            aws_payer_account_id = aws_payer_acount.split(':')[0]
-            identity_region = aws_payer_acount.split(':')[1]
-        else:
-            aws_payer_account_id = aws_payer_acount
-            identity_region = QS_REGION
-        aws_org_client = assume_management_role(aws_payer_account_id, identity_region)
-        root_ou = aws_org_client.list_roots()['Roots'][0]['Id']
-        rls_logger.debug(f"Start processing for AWS payer account: {aws_payer_account_id}, root_ou: {root_ou}, with QS Region: {identity_region}")
-        ou_tag_data = process_ou(aws_org_client, root_ou, ou_tag_data, root_ou)
-        ou_tag_data = process_root_ou(aws_org_client, aws_payer_account_id, root_ou, ou_tag_data)  # -> will recreate root process
-        qs_email_user_map = {}
-        for key, value in qs_users.items():
-            if value not in qs_email_user_map:
-                qs_email_user_map[value] = [key]
-            else:
-                qs_email_user_map[value].append(key)
-        # process all tags from all OU
-        for user in ou_tag_data['Users']:
-            rls_logger.debug(f"Checking if USER_EMAIL:{user} is among active QuickSight users")
-            if user in qs_email_user_map:
-                for qs_user in qs_email_user_map[user]:
-                    if user not in cid_full_access_users:
-                        rls_logger.debug(f"User: {user} is among active QuickSight users")
-                        qs_rls['Users'][qs_user] = ou_tag_data['Users'][user]
-                    else:
-                        rls_logger.debug(f"User: {user} is a full access active QuickSight users")
-                        qs_rls['Users'][qs_user] = {'full_access': True}
+    rls_logger.debug(f"Active QuickSight users by email: {qs_email_user_map}")
+    for payer_tag_data, payer_state in process_payers([r.strip() for r in MANAGEMENT_ACCOUNT_IDS.split(',')], tags_cache, rls_state):
+        new_rls_state['payers'][payer_state['payer_id']] = payer_state
+        ou_tag_data = merge_rls_data(ou_tag_data, payer_tag_data)
+    new_rls_state['fingerprint'] = get_fingerprint({
+        'payers': {payer_id: payer_state['fingerprint'] for payer_id, payer_state in new_rls_state['payers'].items()},
+        'qs_users': qs_email_user_map,
+        'full_access': [cid_full_access_users, CID_FULL_ACCESS_GROUP],
+    })
+    if RLS_INCREMENTAL and new_rls_state['fingerprint'] == rls_state.get('fingerprint'):
+        rls_logger.info("Orgs, tags and QuickSight users are unchanged since the last run, skipping RLS upload")
+        return
+
+    # process all tags from all OU
+    for user in ou_tag_data['Users']:
+        rls_logger.debug(f"Checking if USER_EMAIL:{user} is among active QuickSight users")
+        if user in qs_email_user_map:
+            for qs_user in qs_email_user_map[user]:
+                if user not in cid_full_access_users:
+                    rls_logger.debug(f"User: {user} is among active QuickSight users")
+                    qs_rls['Users'][qs_user] = ou_tag_data['Users'][user]
+                else:
+                    rls_logger.debug(f"User: {user} is a full access active QuickSight users")
+                    qs_rls['Users'][qs_user] = new_rls_entry(full_access=True)
     qs_rls['Groups'] = ou_tag_data['Groups']
     rls_logger.debug(f"List of Active QuickSight users: {qs_email_user_map}")
     rls_logger.debug(f"Dictionary with QuickSight  RLS DATA: {qs_rls}")
     rls_s3_filename = "cid_rls.csv"
-    write_csv(qs_rls, rls_s3_filename)
-
-
-def get_qs_users(account_id, qs_client):
-    rls_logger.debug("Fetching Active QuickSight users, Getting first page, NextToken: 0")
-    qs_users_result = (qs_client.list_users(AwsAccountId=account_id, MaxResults=100, Namespace='default'))
-    qs_users = qs_users_result['UserList']
-
-    while 'NextToken' in qs_users_result:
-        NextToken = qs_users_result['NextToken']
-        qs_users_result = (qs_client.list_users(AwsAccountId=account_id, MaxResults=100, Namespace='default', NextToken=NextToken))
-        qs_users.extend(qs_users_result['UserList'])
-        rls_logger.debug("Fetching QuickSight users, getting Next Page, NextToken: {}".format(NextToken.split('/')[0]))
-
-    for qs_users_index, qs_user in enumerate(qs_users):
-        qs_user = {'UserName': qs_user['UserName'], 'Email': qs_user['Email']}
-        qs_users[qs_users_index] = qs_user
-
-    return qs_users
-
-
-def process_account(account_id, ou_tag_data, ou, org_client):
+    if write_csv(qs_rls, rls_s3_filename):
+        write_rls_state(new_rls_state)
+
+
+def get_qs_users(account_id, qs_client, namespace='default'):
+    """ Yield compact (UserName, Email) records of QuickSight users page by page """
+    rls_logger.debug(f"Fetching QuickSight users of namespace: {namespace}")
+    for page in qs_client.get_paginator('list_users').paginate(AwsAccountId=account_id, Namespace=namespace, PaginationConfig={'PageSize': 100}):
+        for qs_user in page['UserList']:
+            yield qs_user['UserName'], qs_user.get('Email')
+
+
+def get_qs_user_index(account_id, qs_client, namespaces):
+    """ Build once per run {email: (UserName, ...)} over all namespaces """
+    qs_email_user_map = {}
+    for namespace in namespaces:
+        for user_name, email in get_qs_users(account_id, qs_client, namespace):
+            if email is None:
+                continue
+            if email not in qs_email_user_map:
+                qs_email_user_map[email] = (user_name,)
+            elif user_name not in qs_email_user_map[email]:
+                qs_email_user_map[email] += (user_name,)
+    rls_logger.debug(f"Indexed {len(qs_email_user_map)} QuickSight user emails from namespaces: {namespaces}")
+    return qs_email_user_map
+
+
+def process_account(account_id, ou_tag_data, ou, tags_cache):
     rls_logger.debug(f"proessing account level tags, processing account_id: {account_id}")
-    tags = org_client.list_tags_for_resource(ResourceId=account_id)['Tags']
+    tags = tags_cache[account_id]
     for tag in tags:
         rls_logger.debug(f"processing child account: {account_id} for ou: {ou}")
         if tag['Key'] == CID_USER_OWNER_TAG:
@@ -198,80 +417,66 @@ def process_account(account_id, ou_tag_data, ou, org_client):
     return ou_tag_data
 
 
-def process_root_ou(org_client, payer_id, root_ou, ou_tag_data):
+def process_root_ou(org_snapshot, payer_id, root_ou, ou_tag_data):
     "PROCESS OU MUST BE PROCESSED LAST"
-    tags = org_client.list_tags_for_resource(ResourceId=root_ou)['Tags']
+    tags = org_snapshot[root_ou]['tags']
     for tag in tags:
         if tag['Key'] == CID_USER_OWNER_TAG:
-            cid_users_tag_value = tag['Value']
-            for user in cid_users_tag_value.split(':'):
-                if user in ou_tag_data['Users']:
-                    if 'payer_id' in ou_tag_data['Users'][user]:
-                        if payer_id not in ou_tag_data['Users'][user]['payer_id']:
-                            ou_tag_data['Users'][user]['payer_id'].append(payer_id)
-                    else:
-                        ou_tag_data['Users'][user]['payer_id'] = [payer_id]
-                else:
-                    ou_tag_data['Users'].update({user: {'payer_id': [payer_id]}})
+            for user in tag['Value'].split(':'):
+                if user not in ou_tag_data['Users']:
+                    ou_tag_data['Users'][user] = new_rls_entry()
+                ou_tag_data['Users'][user]['payer_id'].add(payer_id)
 
         if tag['Key'] == CID_GROUP_OWNER_TAG:
-            cid_groups_tag_value = tag['Value']
-            for group in cid_groups_tag_value.split(':'):
-                if group in ou_tag_data['Groups']:
-                    if 'payer_id' in ou_tag_data['Groups'][group]:
-                        if payer_id not in ou_tag_data['Groups'][group]['payer_id']:
-                            ou_tag_data['Groups'][group]['payer_id'].append(payer_id)
-                    else:
-                        ou_tag_data['Groups'][group]['payer_id'] = [payer_id]
-                else:
-                    ou_tag_data['Groups'].update({group: {'payer_id': [payer_id]}})
+            for group in tag['Value'].split(':'):
+                if group not in ou_tag_data['Groups']:
+                    ou_tag_data['Groups'][group] = new_rls_entry()
+                ou_tag_data['Groups'][group]['payer_id'].add(payer_id)
     return ou_tag_data
 
 
-def process_ou(org_client, ou, ou_tag_data, root_ou):
+def process_ou(tags_cache, org_snapshot, ou, ou_tag_data, root_ou, inherited_tags=None):
+    """ Walk the org snapshot top-down. Tags of an OU are inherited by all accounts of this OU and its children OUs.
+        Tags of the root ou are only applied to accounts at root level, for ROOT_OU we have a separate function process_root_ou. """
     rls_logger.debug(f"Start processing ou {ou}, for root ou: {root_ou}")
-    tags = org_client.list_tags_for_resource(ResourceId=ou)['Tags']
-    rls_logger.debug(f"Adding tags to all subacounts of  {ou}, for root ou: {root_ou}")
-    for tag in tags:
-        if tag['Key'] == CID_GROUP_OWNER_TAG:  # ADD GROUP TAGS
-            cid_groups_tag_value = tag['Value']
-            """ Do not process all children if this is root ou, for ROOT_OU we have a separate function, this is done bellow in separate cycle. """
-            process_ou_children = bool(ou != root_ou)
-            user_ou_accounts = get_ou_accounts(org_client, ou, process_ou_children=process_ou_children)
-            for account in user_ou_accounts:
-                account_id = account['Id']
-                rls_logger.debug(f"Adding inherit USER tag: {cid_groups_tag_value} for ou: {ou} to account_id: {account_id}")
-                ou_tag_data = update_tag_data(account_id, None, cid_groups_tag_value, ou_tag_data)
-
-        if tag['Key'] == CID_USER_OWNER_TAG:  # ADD USER TAGS
-            cid_users_tag_value = tag['Value']
-            """ Do not process all children if this is root ou, for ROOT_OU we have a separate function, this is done bellow in separate cycle. """
-            process_ou_children = bool(ou != root_ou)
-            group_ou_accounts = get_ou_accounts(org_client, ou, process_ou_children=process_ou_children)
-            for account in group_ou_accounts:
-                account_id = account['Id']
-                rls_logger.debug(f"Adding inherit GROUP tag: {cid_users_tag_value} for ou: {ou} to account_id: {account_id}")
-                ou_tag_data = update_tag_data(account_id, cid_users_tag_value, None, ou_tag_data)
-
-    children_ou = get_children_ou(ou, org_client)
+    ou_tags = [tag for tag in org_snapshot[ou]['tags'] if tag['Key'] in (CID_USER_OWNER_TAG, CID_GROUP_OWNER_TAG)]
+    account_tags = (inherited_tags or []) + ou_tags
+    ou_accounts = org_snapshot[ou]['accounts']
+    rls_logger.debug(f"Adding tags to all subacounts of  {ou}, for root ou: {root_ou}, ou_accounts:{ou_accounts}")
+    for account_id in ou_accounts:
+        for tag in account_tags:
+            if tag['Key'] == CID_GROUP_OWNER_TAG:  # ADD GROUP TAGS
+                rls_logger.debug(f"Adding inherit GROUP tag: {tag['Value']} for ou: {ou} to account_id: {account_id}")
+                ou_tag_data = update_tag_data(account_id, None, tag['Value'], ou_tag_data)
+            elif tag['Key'] == CID_USER_OWNER_TAG:  # ADD USER TAGS
+                rls_logger.debug(f"Adding inherit USER tag: {tag['Value']} for ou: {ou} to account_id: {account_id}")
+                ou_tag_data = update_tag_data(account_id, tag['Value'], None, ou_tag_data)
+        rls_logger.debug(f"Getting tags for account: {account_id} of ou: {ou}")
+        ou_tag_data = process_account(account_id, ou_tag_data, ou, tags_cache)
+
+    children_inherited_tags = inherited_tags if ou == root_ou else account_tags
+    children_ou = org_snapshot[ou]['children']
     if len(children_ou) > 0:
         rls_logger.debug(f"Itterating other OUS: {children_ou} for parrent ou: {ou}")
         for child_ou in children_ou:
             rls_logger.debug(f"Processing child ou: {child_ou}, parent ou: {ou}, root ou: {root_ou}")
-            ou_tag_data = process_ou(org_client, child_ou, ou_tag_data, root_ou)
+            ou_tag_data = process_ou(tags_cache, org_snapshot, child_ou, ou_tag_data, root_ou, children_inherited_tags)
     else:
         rls_logger.debug(f"got 0 children OUS for parent ou: {ou}")
-
-    ou_accounts = get_ou_accounts(org_client, ou, process_ou_children=False)  # Do not process children, only accounts at OU level.
-    ou_accounts_ids = [ou_account['Id'] for ou_account in ou_accounts]
-    rls_logger.debug(f"Getting accounts in  OU: {ou} ########################### ou_accounts:{ou_accounts_ids}")
-    for account in ou_accounts:
-        account_id = account['Id']
-        rls_logger.debug(f"Getting tags for account: {account_id} of ou: {ou}")
-        ou_tag_data = process_account(account_id, ou_tag_data, ou, org_client)
     return ou_tag_data
 
 
+def get_rls_row(user, group, rls_entry):
+    """ we will write empty account_id, if payer_id is present, cause the user should see all accounts under one payer
+        and we will write empty payer_id if payer_id is absent """
+    row = {'UserName': user, 'GroupName': group, 'account_id': "", 'payer_account_id': ""}
+    if rls_entry['payer_id']:
+        row['payer_account_id'] = ",".join(sorted(rls_entry['payer_id']))
+    elif not rls_entry['full_access']:
+        row['account_id'] = ",".join(sorted(rls_entry['account_id']))
+    return row
+
+
 def write_csv(qs_rls, rls_s3_filename):
     with open(TMP_RLS_FILE, 'w', newline='') as cid_rls_csv_file:
         wrt = csv.DictWriter(cid_rls_csv_file, fieldnames=RLS_HEADER)
@@ -282,45 +487,19 @@ def write_csv(qs_rls, rls_s3_filename):
                           'GroupName': CID_FULL_ACCESS_GROUP,
                           'account_id': "",
                           'payer_account_id': ""})
-        for group in qs_rls['Groups']:
-            """ we will write empty account_id, if payer_id is present, cause the user should see all accounts under one payer
-                and we will write empty payer_id if payer_id is absent """
-            if 'payer_id' in qs_rls['Groups'][group]:
-                wrt.writerow({'UserName': "",
-                              'GroupName': group,
-                              'account_id': "",
-                              'payer_account_id': ",".join(qs_rls['Groups'][group]['payer_id'])})
-            elif qs_rls['Groups'][group].get('full_access'):
-                wrt.writerow({'UserName': "",
-                              'GroupName': group,
-                              'account_id': "",
-                              'payer_account_id': ""})
-            else:
-                wrt.writerow({'UserName': "",
-                              'GroupName': group,
-                              'account_id': ",".join(qs_rls['Groups'][group]['account_id']),
-                              'payer_account_id': ""})
-
-        for user in qs_rls['Users']:
-            """ we will write empty account_id, if payer_id is present, cause the user should see all accounts under one payer
-                and we will write empty payer_id if payer_id is absent """
-            if 'payer_id' in qs_rls['Users'][user]:
-                wrt.writerow({'UserName': user,
-                              'GroupName': "",
-                              'account_id': "",
-                              'payer_account_id': ",".join(qs_rls['Users'][user]['payer_id'])})
-            elif qs_rls['Users'][user].get('full_access'):
-                wrt.writerow({'UserName': user,
-                              'GroupName': "",
-                              'account_id': "",
-                              'payer_account_id': ""})
-            else:
-                wrt.writerow({'UserName': user,
-                              'GroupName': "",
-                              'account_id': ",".join(qs_rls['Users'][user]['account_id']),
-                              'payer_account_id': ""})
-
-    upload_to_s3(TMP_RLS_FILE, rls_s3_filename)
+        for group in sorted(qs_rls['Groups']):
+            wrt.writerow(get_rls_row("", group, qs_rls['Groups'][group]))
+        for user in sorted(qs_rls['Users']):
+            wrt.writerow(get_rls_row(user, "", qs_rls['Users'][user]))
+
+    content_hash = get_file_hash(TMP_RLS_FILE)
+    if RLS_INCREMENTAL and content_hash == get_published_hash(rls_s3_filename):
+        rls_logger.info(f"RLS content is unchanged (sha256 {content_hash}), skipping upload")
+        return True
+    if not upload_to_s3(TMP_RLS_FILE, rls_s3_filename, metadata={'content-sha256': content_hash}):
+        return False
+    start_ingestion()
+    return True
 
 
 def set_log_level(RLS_LOGGING_LEVEL):
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+""" Offline benchmark of RLS generation (rls/deploy/create_rls.py) against synthetic AWS Organizations
+
+Organizations, QuickSight, S3 and STS calls are served from memory, so no AWS account is needed.
+Reports API call counts, wall time and peak memory for each run.
+
+Example:
+    python rls/utils/benchmark_rls.py --depth 3 --fanout 4 --accounts 3000 --tag-density 0.3 --latency 20 --runs 2
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import threading
+import tracemalloc
+from collections import Counter
+from unittest import mock
+
+import boto3
+
+CODE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'deploy')
+QS_ACCOUNT_ID = '111111111111'
+
+
+class ApiStats:
+    """ Thread safe counter of API calls with optional simulated latency """
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = Counter()
+        self.lock = threading.Lock()
+
+    def call(self, service, operation):
+        with self.lock:
+            self.calls[f'{service}:{operation}'] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+
+def paginate(items, kwargs, max_results):
+    """ returns page of items and NextToken the same way AWS APIs do """
+    start = int(kwargs.get('NextToken', 0))
+    end = start + kwargs.get('MaxResults', max_results)
+    return items[start:end], (str(end) if end < len(items) else None)
+
+
+class FakePaginator:
+    def __init__(self, method, page_size):
+        self.method = method
+        self.page_size = page_size
+
+    def paginate(self, PaginationConfig=None, **kwargs):  # pylint: disable=invalid-name
+        kwargs['MaxResults'] = (PaginationConfig or {}).get('PageSize', self.page_size)
+        while True:
+            page = self.method(**kwargs)
+            yield page
+            if not page.get('NextToken'):
+                break
+            kwargs['NextToken'] = page['NextToken']
+
+
+class FakeOrganizations:
+    def __init__(self, org, stats):
+        self.org = org
+        self.stats = stats
+
+    def list_roots(self):
+        self.stats.call('organizations', 'ListRoots')
+        return {'Roots': [{'Id': self.org['root']}]}
+
+    def list_organizational_units_for_parent(self, ParentId, **kwargs):  # pylint: disable=invalid-name
+        self.stats.call('organizations', 'ListOrganizationalUnitsForParent')
+        ous, next_token = paginate(self.org['children'].get(ParentId, []), kwargs, 20)
+        res = {'OrganizationalUnits': [{'Id': ou} for ou in ous]}
+        if next_token:
+            res['NextToken'] = next_token
+        return res
+
+    def list_accounts_for_parent(self, ParentId, **kwargs):  # pylint: disable=invalid-name
+        self.stats.call('organizations', 'ListAccountsForParent')
+        accounts, next_token = paginate(self.org['accounts'].get(ParentId, []), kwargs, 20)
+        res = {'Accounts': [{'Id': account, 'Status': 'ACTIVE'} for account in accounts]}
+        if next_token:
+            res['NextToken'] = next_token
+        return res
+
+    def list_tags_for_resource(self, ResourceId, **kwargs):  # pylint: disable=invalid-name
+        self.stats.call('organizations', 'ListTagsForResource')
+        tags, next_token = paginate(self.org['tags'].get(ResourceId, []), kwargs, 20)
+        res = {'Tags': tags}
+        if next_token:
+            res['NextToken'] = next_token
+        return res
+
+    def get_paginator(self, name):
+        return FakePaginator(getattr(self, name), 20)
+
+
+class FakeQuickSight:
+    def __init__(self, users, stats):
+        self.users = users
+        self.stats = stats
+
+    def list_users(self, AwsAccountId, Namespace, **kwargs):  # pylint: disable=invalid-name,unused-argument
+        self.stats.call('quicksight', 'ListUsers')
+        users, next_token = paginate(self.users.get(Namespace, []), kwargs, 100)
+        res = {'UserList': users}
+        if next_token:
+            res['NextToken'] = next_token
+        return res
+
+    def create_ingestion(self, **kwargs):  # pylint: disable=unused-argument
+        self.stats.call('quicksight', 'CreateIngestion')
+
+    def get_paginator(self, name):
+        return FakePaginator(getattr(self, name), 100)
+
+
+class FakeS3:
+    def __init__(self, objects, stats):
+        self.objects = objects
+        self.stats = stats
+
+    def upload_file(self, file, bucket, key, ExtraArgs=None):  # pylint: disable=invalid-name
+        self.stats.call('s3', 'PutObject')
+        with open(file, 'rb') as data:
+            self.objects[(bucket, key)] = (data.read(), (ExtraArgs or {}).get('Metadata', {}))
+
+    def put_object(self, Bucket, Key, Body, Metadata=None):  # pylint: disable=invalid-name
+        self.stats.call('s3', 'PutObject')
+        self.objects[(Bucket, Key)] = (Body, Metadata or {})
+
+    def get_object(self, Bucket, Key):  # pylint: disable=invalid-name
+        self.stats.call('s3', 'GetObject')
+        if (Bucket, Key) not in self.objects:
+            raise KeyError(f'NoSuchKey: {Key}')
+        return {'Body': mock.Mock(read=lambda: self.objects[(Bucket, Key)][0])}
+
+    def head_object(self, Bucket, Key):  # pylint: disable=invalid-name
+        self.stats.call('s3', 'HeadObject')
+        if (Bucket, Key) not in self.objects:
+            raise KeyError(f'NotFound: {Key}')
+        return {'Metadata': self.objects[(Bucket, Key)][1]}
+
+
+class FakeSts:
+    def __init__(self, stats):
+        self.stats = stats
+
+    def get_caller_identity(self):
+        self.stats.call('sts', 'GetCallerIdentity')
+        return {'Account': QS_ACCOUNT_ID}
+
+    def assume_role(self, RoleArn, **kwargs):  # pylint: disable=invalid-name,unused-argument
+        self.stats.call('sts', 'AssumeRole')
+        payer_id = RoleArn.split(':')[4]
+        return {'Credentials': {'AccessKeyId': payer_id, 'SecretAccessKey': 'secret', 'SessionToken': 'token'}}
+
+
+class FakeAws:
+    """ Serves boto3.client() and boto3.session.Session().client() calls from synthetic data """
+    def __init__(self, orgs, qs_users, stats):
+        self.orgs = orgs
+        self.qs_users = qs_users
+        self.stats = stats
+        self.s3_objects = {}
+
+    def client(self, service_name, region_name=None, **kwargs):  # pylint: disable=unused-argument
+        if service_name == 'organizations':
+            return FakeOrganizations(self.orgs[kwargs['aws_access_key_id']], self.stats)
+        if service_name == 'quicksight':
+            return FakeQuickSight(self.qs_users, self.stats)
+        if service_name == 's3':
+            return FakeS3(self.s3_objects, self.stats)
+        if service_name == 'sts':
+            return FakeSts(self.stats)
+        raise NotImplementedError(service_name)
+
+    def session(self, *args, **kwargs):  # pylint: disable=unused-argument
+        return mock.Mock(client=self.client, get_partition_for_region=lambda region_name: 'aws')
+
+
+def generate_org(payer_id, depth, fanout, accounts, tag_density, emails, groups, rnd):
+    """ returns synthetic org: OU tree of given depth and fan-out with accounts spread evenly over all OUs """
+    root = f'r-{payer_id[:4]}'
+    org = {'root': root, 'children': {}, 'accounts': {}, 'tags': {}}
+    ous = [root]
+    level = [root]
+    for level_index in range(depth):
+        next_level = []
+        for parent in level:
+            for child_index in range(fanout):
+                ou = f'ou-{payer_id[:4]}-{level_index}-{len(ous)}-{child_index}'
+                org['children'].setdefault(parent, []).append(ou)
+                next_level.append(ou)
+                ous.append(ou)
+        level = next_level
+    for account_index in range(accounts):
+        account_id = f'{payer_id[:4]}{account_index:08d}'
+        org['accounts'].setdefault(ous[account_index % len(ous)], []).append(account_id)
+    for resource_id in ous + [a for accs in org['accounts'].values() for a in accs]:
+        tags = []
+        if rnd.random() < tag_density:
+            tags.append({'Key': 'cid_users', 'Value': ':'.join(rnd.sample(emails, min(2, len(emails))))})
+        if rnd.random() < tag_density:
+            tags.append({'Key': 'cid_groups', 'Value': rnd.choice(groups)})
+        if tags:
+            org['tags'][resource_id] = tags
+    return org
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--payers', type=int, default=1, help='number of management accounts')
+    parser.add_argument('--depth', type=int, default=3, help='depth of OU tree under root')
+    parser.add_argument('--fanout', type=int, default=4, help='children OUs per OU')
+    parser.add_argument('--accounts', type=int, default=1000, help='accounts per payer')
+    parser.add_argument('--tag-density', type=float, default=0.3, help='probability of an OU/account to have each of cid tags')
+    parser.add_argument('--users', type=int, default=500, help='number of QuickSight users')
+    parser.add_argument('--groups', type=int, default=20, help='number of distinct group tag values')
+    parser.add_argument('--latency', type=float, default=0, help='simulated latency of each API call in ms')
+    parser.add_argument('--runs', type=int, default=1, help='number of consecutive runs, runs after the first one exercise incremental mode')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    rnd = random.Random(args.seed)
+    emails = [f'user{index}@example.com' for index in range(args.users)]
+    groups = [f'group{index}' for index in range(args.groups)]
+    payer_ids = [f'{9000 + index}00000000' for index in range(args.payers)]
+    orgs = {payer_id: generate_org(payer_id, args.depth, args.fanout, args.accounts, args.tag_density, emails, groups, rnd) for payer_id in payer_ids}
+    qs_users = {'default': [{'UserName': f'qs_{email}', 'Email': email} for email in emails]}
+    stats = ApiStats(args.latency / 1000)
+    fake_aws = FakeAws(orgs, qs_users, stats)
+
+    tmp_dir = tempfile.mkdtemp()
+    os.environ.update({
+        'BUCKET_NAME': 'benchmark-bucket',
+        'QS_REGION': 'us-east-1',
+        'MANAGEMENTROLENAME': 'benchmark-role',
+        'MANAGEMENT_ACCOUNT_IDS': ','.join(payer_ids),
+        'TMP_RLS_FILE': os.path.join(tmp_dir, 'cid_rls.csv'),
+        'RLS_LOGGING_LEVEL': os.environ.get('RLS_LOGGING_LEVEL', 'WARNING'),
+    })
+    ous_count = sum(1 + sum(len(children) for children in org['children'].values()) for org in orgs.values())
+    print(f'Synthetic orgs: {args.payers} payers, {ous_count} OUs, {args.accounts * args.payers} accounts, '
+          f'{len(emails)} QuickSight users, latency {args.latency}ms')
+
+    with mock.patch.object(boto3, 'client', fake_aws.client), mock.patch.object(boto3.session, 'Session', fake_aws.session):
+        sys.path.insert(0, CODE_PATH)
+        import create_rls  # pylint: disable=import-outside-toplevel,import-error
+        for run in range(args.runs):
+            stats.calls.clear()
+            tracemalloc.start()
+            start = time.perf_counter()
+            create_rls.main()
+            duration = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(json.dumps({
+                'run': run + 1,
+                'wall_time_s': round(duration, 3),
+                'peak_memory_mb': round(peak / 1024 / 1024, 2),
+                'api_calls_total': sum(stats.calls.values()),
+                'api_calls': dict(sorted(stats.calls.items())),
+            }, indent=2))
+
+
+if __name__ == '__main__':
+    main()